@@ -1,14 +1,66 @@
 import os
+import queue
+import re
+import tempfile
 import zipfile
-import fiona
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from loguru import logger
+import pymupdf
 import pymupdf4llm
-from thefuzz import process
+import pyarrow.parquet as pq
+from rapidfuzz import process, fuzz
+from shapely.errors import GEOSException
 from unidecode import unidecode
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+# Pool acotado de Figures de matplotlib reutilizadas entre peticiones (LifoQueue ya es thread-safe)
+FIGSIZE = (12, 10)
+_FIG_POOL = queue.LifoQueue(maxsize=4)
+
+# Priority list of column names (Spanish shapefiles for municipalities)
+POSIBLES_COLS = [
+    'NAMEUNIT', 'NOMBRE', 'MUNICIPIO', 'NOM_MUN', 'NM_MUN', 'MUNIC',
+    'NAME', 'NMUN', 'DENOMINACI', 'ROTULO', 'TEXTO', 'ETIQUETA',
+    'NOMBRE_MUN', 'NAMEUNI', 'MUNI_NAME'
+]
+
+# Filas usadas para detectar la columna de nombre cuando no está en la lista de prioridad
+MUESTRA_COLS = 1000
+
+# Filas mínimas del texto plano para no recurrir a pymupdf4llm
+MIN_FILAS_TEXTO = 5
+
+# Tildes y diacríticos habituales en topónimos españoles (unidecode solo para el resto)
+_TRANS = str.maketrans(
+    "áéíóúñÁÉÍÓÚÑüÜàèìòùÀÈÌÒÙïÏçÇ",
+    "aeiounAEIOUNuUaeiouAEIOUiIcC"
+)
+_NO_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+# Regex patterns for Spanish climate zones
+# Pattern 1: Letter + Number (+ optional lowercase): A1, B3, D3, E1, α1, etc.
+# Pattern 2: Roman numerals: I, II, III, IV, V
+_ZONA_PAT = r'[A-Eα-ε][1-4][a-z]?|I{1,3}V?|IV|V'
+# Table row "Municipio ... Zona": the zone is the last token of the line, once markdown
+# pipes are treated as separators. Headings (#) and rules (---) are skipped.
+_LINE_RE = re.compile(
+    r'^(?![^\S\n]*(?:#|---))([^\n]*?)(?:[^\S\n]|\|)+(' + _ZONA_PAT + r')(?:[^\S\n]|\|)*$',
+    re.MULTILINE | re.IGNORECASE
+)
+_WS_RE = re.compile(r'\s+')
+# Look for patterns like "Municipio Name   D3" anywhere in the text
+_AGG_RE = re.compile(
+    r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñA-ZÁÉÍÓÚÑ]+)*?)\s+([A-E][1-4][a-z]?)',
+    re.MULTILINE
+)
+
 def extraer_shp_desde_zip(zip_path: str, tmpdir: str) -> str:
     """
     Descomprime un .zip con un shapefile y devuelve la ruta al .shp extraído.
@@ -20,89 +72,115 @@ def extraer_shp_desde_zip(zip_path: str, tmpdir: str) -> str:
         zip_ref.extractall(extract_path)
 
     # Buscar recursivamente el archivo .shp
-    shp_files = []
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            if file.endswith(".shp"):
-                shp_files.append(os.path.join(root, file))
+    shp_files = list(Path(extract_path).rglob("*.shp"))
     
     if not shp_files:
         raise FileNotFoundError("No se encontró ningún archivo .shp en el ZIP.")
     
     # Preferir uno que no empiece por ._ (archivos basura de macOS)
-    valid_shp = [f for f in shp_files if not os.path.basename(f).startswith("._")]
-    return valid_shp[0] if valid_shp else shp_files[0]
+    valid_shp = [p for p in shp_files if not p.name.startswith("._")]
+    return str(valid_shp[0] if valid_shp else shp_files[0])
+
+def _parsear_filas(text: str) -> pd.DataFrame:
+    """
+    Extrae las filas "Municipio Zona" de un texto (plano o Markdown) con una sola pasada de regex.
+    """
+    df = pd.DataFrame(_LINE_RE.findall(text), columns=["Municipio", "Zona"])
+    df["Municipio"] = (
+        df["Municipio"].str.replace('|', ' ', regex=False)
+        .str.replace(_WS_RE, ' ', regex=True)  # Normalize whitespace
+        .str.strip()
+    )
+    df["Zona"] = df["Zona"].str.upper()
+    return df[df["Municipio"].str.len() > 2].reset_index(drop=True)
 
 def extraer_datos_pdf(pdf_path: str) -> pd.DataFrame:
     """
-    Extrae la tabla de zonas climáticas del PDF usando pymupdf4llm (Markdown).
+    Extrae la tabla de zonas climáticas del PDF a partir del texto plano de PyMuPDF,
+    recurriendo a pymupdf4llm (Markdown) si la tabla no sale en líneas simples.
     Busca patrones de líneas que parezcan filas de datos: "Municipio Zona".
     
     Spanish climate zones are typically: A1, A2, A3, A4, B1, B2, B3, B4, C1, C2, C3, C4, D1, D2, D3, E1
     Or sometimes Roman numerals: I, II, III, IV, V
     """
-    import re
-    
-    md_text = pymupdf4llm.to_markdown(pdf_path)
-    lines = md_text.split('\n')
-    
-    logger.info(f"PDF convertido a Markdown, {len(lines)} líneas encontradas.")
-    logger.debug(f"Primeras 500 chars: {md_text[:500]}")
+    with pymupdf.open(pdf_path) as doc:
+        text = "\n".join(page.get_text("text") for page in doc)
+    n_lines = text.count('\n') + 1
     
-    data = []
+    logger.info(f"PDF convertido a texto, {n_lines} líneas encontradas.")
+    df = _parsear_filas(text)
+    md_text = text
     
-    # Regex patterns for Spanish climate zones
-    # Pattern 1: Letter + Number (+ optional lowercase): A1, B3, D3, E1, α1, etc.
-    # Pattern 2: Roman numerals: I, II, III, IV, V
-    zona_pattern = re.compile(r'^([A-Eα-ε][1-4][a-z]?|I{1,3}V?|IV|V)$', re.IGNORECASE)
-    
-    for line in lines:
-        # Clean markdown table delimiters
-        clean_line = line.strip()
-        if not clean_line or clean_line.startswith('#') or clean_line.startswith('---'):
-            continue
-        
-        # Remove markdown table pipes
-        clean_line = clean_line.replace('|', ' ').strip()
-        clean_line = re.sub(r'\s+', ' ', clean_line)  # Normalize whitespace
+    if len(df) < MIN_FILAS_TEXTO:
+        # La tabla no sale en líneas simples: usar la detección de tablas de pymupdf4llm
+        logger.info(f"Texto plano con {len(df)} filas válidas. Convirtiendo a Markdown...")
+        md_text = pymupdf4llm.to_markdown(pdf_path)
+        n_lines = md_text.count('\n') + 1
         
-        parts = clean_line.rsplit(maxsplit=1)
-        if len(parts) == 2:
-            muni, zona = parts
-            zona = zona.strip().upper()
-            
-            # Validate zone format
-            if zona_pattern.match(zona) and len(muni) > 2:
-                data.append({"Municipio": muni.strip(), "Zona": zona})
-    
-    if not data:
+        logger.info(f"PDF convertido a Markdown, {n_lines} líneas encontradas.")
+        logger.debug(f"Primeras 500 chars: {md_text[:500]}")
+        df_md = _parsear_filas(md_text)
+        if len(df_md) >= len(df):
+            df = df_md
+    
+    if df.empty:
         # Fallback: Try more aggressive regex on raw text
         logger.warning(f"Parseo simple falló. Intentando regex agresivo...")
         logger.warning(f"Preview MD: {md_text[:800]}")
         
-        # Look for patterns like "Municipio Name   D3" anywhere in the text
-        aggressive_pattern = re.compile(
-            r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[a-záéíóúñA-ZÁÉÍÓÚÑ]+)*?)\s+([A-E][1-4][a-z]?)',
-            re.MULTILINE
-        )
-        
-        matches = aggressive_pattern.findall(md_text)
+        data_muni = []
+        data_zona = []
+        matches = _AGG_RE.findall(md_text)
         for muni, zona in matches:
             if len(muni) > 3:  # Avoid false positives
-                data.append({"Municipio": muni.strip(), "Zona": zona.strip().upper()})
+                data_muni.append(muni.strip())
+                data_zona.append(zona.strip().upper())
+        df = pd.DataFrame({"Municipio": data_muni, "Zona": data_zona})
     
-    if not data:
+    if df.empty:
         # Last resort: log what we found and fail gracefully
         sample = md_text[:1000].replace('\n', ' | ')
         raise ValueError(f"No se encontraron pares Municipio-Zona en el PDF. Contenido: {sample}")
     
-    logger.info(f"Extraídos {len(data)} municipios del PDF")
-    return pd.DataFrame(data)
+    logger.info(f"Extraídos {len(df)} municipios del PDF")
+    return df
+
+def normalizar_serie(serie: pd.Series) -> pd.Series:
+    """
+    Normaliza nombres para el cruce: sin tildes (tabla de traducción, unidecode solo para el resto),
+    en minúsculas y sin espacios en los extremos. Opera sobre la Series completa con los
+    métodos .str de pandas.
+    """
+    serie = serie.str.translate(_TRANS)
+    resto = serie.str.contains(_NO_ASCII_RE, na=False)
+    if resto.any():
+        serie = serie.where(~resto, serie[resto].map(unidecode))  # Caracteres fuera de la tabla
+    return serie.str.lower().str.strip()
 
-def normalizar_texto(texto):
-    if not isinstance(texto, str):
-        return ""
-    return unidecode(texto).lower().strip()
+def _find_by_name(columns) -> str | None:
+    """
+    Devuelve la columna de nombre de municipio según la lista de prioridad (con su capitalización real).
+    """
+    upper_cols = {c.upper(): c for c in reversed(list(columns))}
+    return next((upper_cols[c] for c in POSIBLES_COLS if c in upper_cols), None)
+
+def _find_by_sample(muestra: pd.DataFrame) -> str | None:
+    """
+    Fallback: columna de texto con mayor longitud media en la muestra (los nombres son más largos que los códigos).
+    """
+    if muestra.empty:
+        return None
+    
+    avg_len = muestra.apply(lambda s: s.dropna().astype(str).str.len().mean()).dropna()
+    if avg_len.empty:
+        return None
+    logger.debug(f"Longitud media por columna: {avg_len.round(1).to_dict()}")
+    
+    best_col = avg_len.idxmax()
+    if avg_len[best_col] > 3:  # Names should be longer than 3 chars on average
+        logger.info(f"Usando columna '{best_col}' (longitud media {avg_len[best_col]:.1f}) para el cruce.")
+        return best_col
+    return None
 
 def unificar_datos(gdf: gpd.GeoDataFrame, df_pdf: pd.DataFrame) -> gpd.GeoDataFrame:
     """
@@ -112,89 +190,168 @@ def unificar_datos(gdf: gpd.GeoDataFrame, df_pdf: pd.DataFrame) -> gpd.GeoDataFr
     logger.info(f"Columnas disponibles en SHP: {list(gdf.columns)}")
     
     # Sample values from string columns to help identify the name column
-    for col in gdf.columns:
-        if pd.api.types.is_string_dtype(gdf[col]):
-            sample = gdf[col].dropna().head(3).tolist()
-            logger.debug(f"Columna '{col}' ejemplos: {sample}")
-    
-    # Priority list of column names (Spanish shapefiles for municipalities)
-    posibles_cols = [
-        'NAMEUNIT', 'NOMBRE', 'MUNICIPIO', 'NOM_MUN', 'NM_MUN', 'MUNIC',
-        'NAME', 'NMUN', 'DENOMINACI', 'ROTULO', 'TEXTO', 'ETIQUETA',
-        'NOMBRE_MUN', 'NAMEUNI', 'MUNI_NAME'
-    ]
-    col_shp = next((c for c in posibles_cols if c.upper() in [x.upper() for x in gdf.columns]), None)
-    
-    # If found by name, get the actual case
-    if col_shp:
-        col_shp = next(c for c in gdf.columns if c.upper() == col_shp.upper())
+    muestra = gdf.head(MUESTRA_COLS).select_dtypes(include=["object", "string"])
+    for col in muestra.columns:
+        logger.debug(f"Columna '{col}' ejemplos: {muestra[col].dropna().head(3).tolist()}")
     
-    if not col_shp:
-        # Fallback: find string column with longest average value (names are longer than codes)
-        best_col = None
-        best_avg_len = 0
-        
-        for col in gdf.columns:
-            if col.lower() == 'geometry':
-                continue
-            if pd.api.types.is_string_dtype(gdf[col]):
-                avg_len = gdf[col].dropna().astype(str).str.len().mean()
-                logger.debug(f"Columna '{col}' longitud media: {avg_len:.1f}")
-                if avg_len > best_avg_len:
-                    best_avg_len = avg_len
-                    best_col = col
-        
-        if best_col and best_avg_len > 3:  # Names should be longer than 3 chars on average
-            col_shp = best_col
-            logger.info(f"Usando columna '{col_shp}' (longitud media {best_avg_len:.1f}) para el cruce.")
+    col_shp = _find_by_name(gdf.columns) or _find_by_sample(muestra)
     
     if not col_shp:
         raise ValueError(f"No se encontró columna de nombre de municipio en el Shapefile. Columnas: {list(gdf.columns)}")
         
     logger.info(f"Usando columna '{col_shp}' del Shapefile para el cruce.")
 
-    # Crear mapa de mapeo fuzzy
+    # Crear mapa de mapeo fuzzy: matriz completa N×M de puntuaciones en C++ (rapidfuzz).
+    # Los nombres se normalizan una sola vez (N+M) y se conservan los originales en paralelo.
     nombres_pdf = df_pdf["Municipio"].unique()
-    mapa_nombres = {}
+    valores_shp = gdf[col_shp].dropna().unique()
+    mask_str = np.fromiter((isinstance(n, str) for n in valores_shp), dtype=bool, count=len(valores_shp))
+    nombres_shp = valores_shp[mask_str]
+    
+    norm_pdf = normalizar_serie(pd.Series(nombres_pdf)).to_numpy()
+    norm_shp = normalizar_serie(pd.Series(nombres_shp)).to_numpy()
     
-    for nombre_shp in gdf[col_shp].unique():
-        if not isinstance(nombre_shp, str): continue
+    # Fast path: coincidencia exacta sobre el nombre normalizado (índice hash, O(N))
+    idx_pdf = pd.Series(nombres_pdf, index=norm_pdf)
+    idx_pdf = idx_pdf[~idx_pdf.index.duplicated(keep="first")]
+    exactos = pd.Series(norm_shp).map(idx_pdf).to_numpy()
+    sin_match = pd.isna(exactos)
+    
+    mapa_nombres = dict(zip(nombres_shp[~sin_match], exactos[~sin_match]))
+    logger.info(f"Coincidencias exactas: {len(mapa_nombres)}; pendientes de fuzzy: {int(sin_match.sum())}")
+    
+    # Fuzzy matching solo sobre el residuo sin coincidencia exacta
+    if sin_match.any():
+        residuo_shp = nombres_shp[sin_match]
+        scores = process.cdist(
+            norm_shp[sin_match],
+            norm_pdf,
+            scorer=fuzz.WRatio,
+            processor=None,
+            score_cutoff=80,
+            workers=-1,
+            dtype=np.uint8,
+        )
+        best_idx = scores.argmax(axis=1)
+        best_score = scores.max(axis=1)
         
-        # Buscar mejor coincidencia en PDF
-        mejor_match, score = process.extractOne(nombre_shp, nombres_pdf)
-        if score > 80: # Umbral de confianza
-            mapa_nombres[nombre_shp] = mejor_match
-        else:
-            mapa_nombres[nombre_shp] = None # No asignado
+        for k, (nombre_shp, i) in enumerate(zip(residuo_shp, best_idx)):
+            # Umbral de confianza; por debajo queda como No asignado
+            mapa_nombres[nombre_shp] = nombres_pdf[i] if best_score[k] > 80 else None
 
     # Aplicar mapeo
     gdf["match_pdf"] = gdf[col_shp].map(mapa_nombres)
     
-    # Merge
-    gdf_final = gdf.merge(df_pdf, left_on="match_pdf", right_on="Municipio", how="left")
-    gdf_final["zona_climatica"] = gdf_final["Zona"].fillna("No asignado")
+    # Enriquecer con los datos del PDF vía diccionario (evita el merge y la copia de geometrías).
+    # Se mantienen las columnas "Municipio" y "Zona" que aportaba el merge; si el SHP ya
+    # las trae, se añaden como "<col>_pdf" para no pisar sus atributos.
+    # Misma regla que el índice exacto: ante municipios repetidos gana la primera fila
+    zonas_por_muni = df_pdf.groupby("Municipio", sort=False)["Zona"].nunique()
+    conflictos = zonas_por_muni[zonas_por_muni > 1].index.tolist()
+    if conflictos:
+        logger.warning(f"Municipios repetidos en el PDF con zonas distintas (se usa la primera): {conflictos}")
+    df_zonas = df_pdf.drop_duplicates("Municipio", keep="first")
+    zona_map = dict(zip(df_zonas["Municipio"], df_zonas["Zona"]))
+    zona = gdf["match_pdf"].map(zona_map)
+    for col, valores in (("Municipio", gdf["match_pdf"]), ("Zona", zona)):
+        gdf[col if col not in gdf.columns else f"{col}_pdf"] = valores
+    gdf["zona_climatica"] = zona.fillna("No asignado")
     
-    return gdf_final
+    return gdf
 
-def generar_mapa_coloreado(pdf_path: str, shp_path: str, tmpdir: str, geojson: bool = False):
+def cargar_shapefile(shp_path: str, tmpdir: str, geojson: bool = False, cache_path: str | None = None) -> gpd.GeoDataFrame:
     """
-    Flujo principal de generación.
+    Carga el GeoDataFrame del ZIP subido. Si se indica `cache_path` (Parquet), lo reutiliza
+    cuando existe y lo genera cuando no, saltándose la extracción y el parseo del shapefile.
     """
-    os.environ["SHAPE_RESTORE_SHX"] = "YES"
+    if cache_path and os.path.exists(cache_path):
+        try:
+            # Para el PNG basta con la columna de nombre (si se reconoce) y la geometría
+            columnas = None
+            if not geojson:
+                col_nombre = _find_by_name(pq.read_schema(cache_path).names)
+                if col_nombre:
+                    columnas = [col_nombre, "geometry"]
+            gdf = gpd.read_parquet(cache_path, columns=columnas)
+            os.utime(cache_path)  # Marca de uso para la expulsión LRU
+            logger.info(f"Shapefile leído de caché: {cache_path}")
+            return gdf
+        except Exception as e:
+            logger.warning(f"Caché de shapefile inválida ({cache_path}): {e}")
 
-    # 1. Procesar SHP
     shp_real_path = extraer_shp_desde_zip(shp_path, tmpdir)
     logger.info(f"Shapefile extraído: {shp_real_path}")
     
-    with fiona.Env():
-        gdf = gpd.read_file(shp_real_path)
+    # Se lee completo para que la caché sirva también a peticiones GeoJSON; el PNG
+    # descarta columnas al leer el Parquet (lectura por columnas).
+    gdf = gpd.read_file(shp_real_path, engine="pyogrio")
+
+    if cache_path and not gdf.empty:
+        # Escritura atómica: otro proceso nunca ve un Parquet a medias
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        os.close(fd)
+        try:
+            gdf.to_parquet(tmp_path)
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Shapefile guardado en caché: {cache_path}")
+        except Exception as e:
+            logger.warning(f"No se pudo cachear el shapefile: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return gdf
+
+def get_fig() -> "Figure":
+    """
+    Saca una Figure del pool o crea una nueva si está vacío.
+    matplotlib se importa aquí (solo salida PNG) para no cargarlo en peticiones GeoJSON.
+    """
+    try:
+        return _FIG_POOL.get_nowait()
+    except queue.Empty:
+        import matplotlib
+        matplotlib.use("Agg")  # Sin backend gráfico en el servidor
+        from matplotlib.figure import Figure
+        return Figure(figsize=FIGSIZE)
+
+def return_fig(fig: "Figure") -> None:
+    """
+    Limpia la Figure y la devuelve al pool; si está lleno, se descarta.
+    """
+    fig.clear()
+    fig.set_size_inches(FIGSIZE)
+    try:
+        _FIG_POOL.put_nowait(fig)
+    except queue.Full:
+        pass
+
+def generar_mapa_coloreado(
+    pdf_path: str,
+    shp_path: str,
+    tmpdir: str,
+    geojson: bool = False,
+    hi_res: bool = False,
+    cache_path: str | None = None,
+):
+    """
+    Flujo principal de generación.
+    """
+    os.environ["SHAPE_RESTORE_SHX"] = "YES"
+
+    # 1 y 2 son independientes: SHP y PDF se procesan en paralelo (GDAL y PyMuPDF liberan el GIL)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        shp_future = ex.submit(cargar_shapefile, shp_path, tmpdir, geojson=geojson, cache_path=cache_path)
+        pdf_future = ex.submit(extraer_datos_pdf, pdf_path)
+
+        # 1. Procesar SHP
+        gdf = shp_future.result()
 
     if gdf.empty:
         raise ValueError("El shapefile está vacío.")
 
     # 2. Procesar PDF
     try:
-        df_pdf = extraer_datos_pdf(pdf_path)
+        df_pdf = pdf_future.result()
         logger.info(f"Extraídas {len(df_pdf)} filas del PDF.")
     except Exception as e:
         logger.error(f"Error leyendo PDF: {e}")
@@ -211,31 +368,53 @@ def generar_mapa_coloreado(pdf_path: str, shp_path: str, tmpdir: str, geojson: b
 
     output_path = os.path.join(tmpdir, "mapa_climatico.png")
     
-    # Plotting
-    fig, ax = plt.subplots(figsize=(12, 10))
+    dpi = 300 if hi_res else 150
     
-    # Zonas sin datos (gris)
-    sin_datos = gdf_final[gdf_final["zona_climatica"] == "No asignado"]
-    if not sin_datos.empty:
-        sin_datos.plot(ax=ax, color="#e0e0e0", edgecolor="white", linewidth=0.5, label="Sin datos")
-        
-    # Zonas con datos
-    con_datos = gdf_final[gdf_final["zona_climatica"] != "No asignado"]
-    if not con_datos.empty:
-        con_datos.plot(
-            ax=ax, 
-            column="zona_climatica", 
-            legend=True, 
-            cmap="viridis", 
-            edgecolor="white", 
-            linewidth=0.5,
-            legend_kwds={'title': "Zona Climática"}
-        )
+    # Solo se necesitan la zona y la geometría para pintar; el resto de atributos sobra
+    gdf_plot = gdf_final[["zona_climatica", "geometry"]]
     
-    plt.title("Zonificación Climática por Municipio")
-    plt.axis("off")
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    plt.close()
+    # Un polígono por zona climática en lugar de uno por municipio (menos draw calls).
+    # Se disuelve antes de simplificar: simplificar cada municipio abre huecos en las
+    # fronteras compartidas que la unión convierte en agujeros.
+    try:
+        gdf_plot = gdf_plot.dissolve(by="zona_climatica", as_index=False)
+    except GEOSException as e:
+        logger.warning(f"No se pudieron disolver las geometrías por zona ({e}). Se pintan por municipio.")
+    
+    # Simplificar geometrías a ~1 píxel de la imagen final (en unidades del CRS)
+    minx, miny, maxx, maxy = gdf_plot.total_bounds
+    tolerance = max(maxx - minx, maxy - miny) / (max(FIGSIZE) * dpi)
+    gdf_plot = gdf_plot.set_geometry(gdf_plot.geometry.simplify(tolerance, preserve_topology=True))
+    
+    # Plotting (Figure reutilizada del pool)
+    fig = get_fig()
+    try:
+        ax = fig.add_subplot()
+        
+        # Zonas sin datos (gris)
+        sin_datos = gdf_plot[gdf_plot["zona_climatica"] == "No asignado"]
+        if not sin_datos.empty:
+            sin_datos.plot(ax=ax, color="#e0e0e0", edgecolor="white", linewidth=0.5, label="Sin datos")
+
+        # Zonas con datos
+        con_datos = gdf_plot[gdf_plot["zona_climatica"] != "No asignado"]
+        if not con_datos.empty:
+            con_datos.plot(
+                ax=ax, 
+                column="zona_climatica", 
+                legend=True, 
+                cmap="viridis", 
+                edgecolor="white", 
+                linewidth=0.5,
+                legend_kwds={'title': "Zona Climática"}
+            )
+
+        ax.set_title("Zonificación Climática por Municipio")
+        ax.axis("off")
+        # compress_level bajo: el deflate de libpng es el coste dominante del PNG
+        fig.savefig(output_path, dpi=dpi, bbox_inches="tight", pil_kwargs={"compress_level": 1})
+    finally:
+        return_fig(fig)
     
     return output_path
 
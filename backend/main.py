@@ -10,7 +10,7 @@ import os
 import time
 import re
 
-from proces import procesar_archivos, UPLOADS_DIR
+from proces import procesar_archivos, UPLOADS_DIR, CHUNK_SIZE
 
 # Rate limiting
 limiter = Limiter(key_func=get_remote_address)
@@ -49,18 +49,17 @@ def sanitize_filename(filename: str) -> str:
 def cleanup_old_files():
     """Elimina archivos en UPLOADS_DIR con más de 1 hora de antigüedad."""
     try:
-        ahora = time.time()
-        for f in os.listdir(UPLOADS_DIR):
-            f_path = os.path.join(UPLOADS_DIR, f)
-            if os.path.isfile(f_path):
-                if ahora - os.path.getmtime(f_path) > 3600:
-                    os.remove(f_path)
-                    logger.info(f"Cleanup: Eliminado archivo antiguo {f}")
+        threshold = time.time() - 3600
+        with os.scandir(UPLOADS_DIR) as it:
+            for entry in it:
+                if entry.is_file() and entry.stat().st_mtime < threshold:
+                    os.remove(entry.path)
+                    logger.info(f"Cleanup: Eliminado archivo antiguo {entry.name}")
     except Exception as e:
         logger.error(f"Error en cleanup: {e}")
 
-async def validate_upload(file: UploadFile, max_size: int, allowed_extensions: list[str]) -> bytes:
-    """Validate file size and extension, return content."""
+async def validate_upload(file: UploadFile, max_size: int, allowed_extensions: list[str]) -> None:
+    """Validate file size and extension without loading the whole file in memory."""
     # Sanitize filename
     file.filename = sanitize_filename(file.filename)
     
@@ -69,14 +68,15 @@ async def validate_upload(file: UploadFile, max_size: int, allowed_extensions: l
     if ext not in allowed_extensions:
         raise HTTPException(status_code=400, detail=f"Extensión no permitida: {ext}. Permitidas: {allowed_extensions}")
     
-    # Read and check size
-    content = await file.read()
-    if len(content) > max_size:
-        raise HTTPException(status_code=413, detail=f"Archivo demasiado grande. Máximo: {max_size // (1024*1024)} MB")
+    # Read in chunks and check size
+    total = 0
+    while chunk := await file.read(CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPException(status_code=413, detail=f"Archivo demasiado grande. Máximo: {max_size // (1024*1024)} MB")
     
     # Reset file position for later use
     await file.seek(0)
-    return content
 
 # ✅ Endpoint principal
 @app.post("/api/procesar/")
@@ -86,14 +86,15 @@ async def procesar(
     background_tasks: BackgroundTasks,
     pdf: UploadFile = File(...), 
     shp: UploadFile = File(...), 
-    geojson: bool = False
+    geojson: bool = False,
+    hi_res: bool = False
 ):
     try:
         # Validate uploads
         await validate_upload(pdf, MAX_PDF_SIZE, [".pdf"])
         await validate_upload(shp, MAX_SHP_SIZE, [".zip"])
         
-        result = procesar_archivos(pdf, shp, geojson)
+        result = procesar_archivos(pdf, shp, geojson, hi_res)
         
         # Programar limpieza
         background_tasks.add_task(cleanup_old_files)
@@ -1,6 +1,8 @@
+import hashlib
 import os
 import tempfile
 import shutil
+from uuid import uuid4
 from fastapi import UploadFile
 from loguru import logger
 from core_logic import generar_mapa_coloreado
@@ -10,7 +12,36 @@ UPLOADS_DIR = "/app/uploads" if os.path.exists("/app/uploads") else os.path.join
 if not os.path.exists(UPLOADS_DIR):
     os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-def procesar_archivos(pdf: UploadFile, shp: UploadFile, geojson: bool = False) -> dict:
+# Tamaño de bloque para copiar subidas a disco
+CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Caché de shapefiles ya parseados (Parquet) indexada por SHA-256 del ZIP
+CACHE_DIR = os.path.join(UPLOADS_DIR, "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+MAX_CACHE_ENTRIES = 8
+
+def guardar_con_hash(upload: UploadFile, path: str) -> str:
+    """Copia la subida a disco por bloques y devuelve su SHA-256."""
+    h = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := upload.file.read(CHUNK_SIZE):
+            h.update(chunk)
+            f.write(chunk)
+    return h.hexdigest()
+
+def evict_cache():
+    """Mantiene como máximo MAX_CACHE_ENTRIES entradas, expulsando las de uso más antiguo."""
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            entries = [e for e in it if e.is_file() and e.name.endswith(".parquet")]
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[MAX_CACHE_ENTRIES:]:
+            os.remove(entry.path)
+            logger.info(f"Caché: Expulsado {entry.name}")
+    except Exception as e:
+        logger.error(f"Error en caché: {e}")
+
+def procesar_archivos(pdf: UploadFile, shp: UploadFile, geojson: bool = False, hi_res: bool = False) -> dict:
     tmpdir = tempfile.mkdtemp()
     try:
         # ✅ Guardar archivos subidos
@@ -18,18 +49,22 @@ def procesar_archivos(pdf: UploadFile, shp: UploadFile, geojson: bool = False) -
         shp_path = os.path.join(tmpdir, shp.filename)
 
         with open(pdf_path, "wb") as f:
-            f.write(pdf.file.read())
-        with open(shp_path, "wb") as f:
-            f.write(shp.file.read())
+            shutil.copyfileobj(pdf.file, f, length=CHUNK_SIZE)
+        shp_hash = guardar_con_hash(shp, shp_path)
+        cache_path = os.path.join(CACHE_DIR, f"{shp_hash}.parquet")
 
         # ✅ Generar salida
-        output = generar_mapa_coloreado(pdf_path, shp_path, tmpdir, geojson=geojson)
+        output = generar_mapa_coloreado(
+            pdf_path, shp_path, tmpdir, geojson=geojson, hi_res=hi_res, cache_path=cache_path
+        )
+        evict_cache()
 
         if geojson:
             return {"geojson": output}
 
         # ✅ Copiar PNG a carpeta persistente
-        filename = os.path.basename(output)
+        # Nombre único por petición: dos peticiones simultáneas no comparten fichero
+        filename = f"mapa_climatico_{uuid4().hex}.png"
         final_path = os.path.join(UPLOADS_DIR, filename)
         shutil.copy(output, final_path)
         logger.info(f"PNG copiado a: {final_path}")